@@ -3,11 +3,14 @@ import yfinance as yf
 import pandas as pd
 import numpy as np
 import plotly.graph_objects as go
-from plotly.subplots import make_subplots
 from datetime import datetime
-from pytrends.request import TrendReq
-import time
+from pathlib import Path
 import requests
+import hashlib
+import time
+import os
+import tempfile
+import contextlib
 
 # Page configuration
 st.set_page_config(
@@ -57,6 +60,24 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+# Signal boxes
+SIGNALS = {
+    'spread_bearish': ("signal-bearish", "Short equities, long FX"),
+    'spread_bullish': ("signal-bullish", "Long equities, short FX"),
+    'spread_neutral': ("signal-neutral", "No divergence"),
+    'concern_high': ("signal-bearish", "High Public Concern"),
+    'concern_normal': ("signal-neutral", "Normal Concern"),
+    'momentum_positive': ("signal-bullish", "Positive Momentum"),
+    'momentum_negative': ("signal-bearish", "Negative Momentum"),
+    'momentum_neutral': ("signal-neutral", "Neutral"),
+    'not_enough_data': ("signal-neutral", "Not enough data"),
+    'load_failed': ("signal-neutral", "Could not load data"),
+}
+SIGNAL_HTML = {
+    key: f'<div class="signal-box {signal_class}">{signal_text}</div>'
+    for key, (signal_class, signal_text) in SIGNALS.items()
+}
+
 # Header
 st.markdown('<h1 class="main-header">🌎 Latam Macro Trading Dashboard</h1>', unsafe_allow_html=True)
 
@@ -102,111 +123,217 @@ volatility_window = st.sidebar.slider("Volatility calculation window", 5, 30, 10
 
 # Get country data
 country_data = countries[selected_country]
-eq_ticker = country_data['equity']
-fx_ticker = country_data['currency']
-local_eq_ticker = country_data['local_equity']
 
 # --- DATA FETCHING ---
 
-@st.cache_data(ttl=3600)
-def download_market_data(ticker, period_days):
+# Cache settings (seconds). Prices pass through the disk cache and then the compute_pipeline memo,
+# so their TTLs are split to keep displayed prices at most MAX_PRICE_AGE old
+CACHE_DIR = Path(__file__).parent / '.cache'
+MAX_PRICE_AGE = 3600
+PIPELINE_CACHE_TTL = 600
+MARKET_CACHE_TTL = MAX_PRICE_AGE - PIPELINE_CACHE_TTL
+MARKET_MISS_TTL = 300
+TRENDS_CACHE_TTL = 86400
+TRENDS_FETCH_MEMO_TTL = 300
+TRENDS_STALE_MAX_AGE = 7 * 86400
+
+def cache_path(prefix, key):
+    digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+    return CACHE_DIR / f'{prefix}_{digest}.parquet'
+
+def read_cached_frame(path, ttl=None):
+    try:
+        if ttl is None or time.time() - path.stat().st_mtime < ttl:
+            return pd.read_parquet(path)
+    except Exception:
+        pass
+    return None
+
+def write_cached_frame(path, frame, max_age):
+    try:
+        CACHE_DIR.mkdir(exist_ok=True)
+    except OSError:
+        return
+    prefix = path.name.split('_', 1)[0]
+    now = time.time()
+    for old_path in CACHE_DIR.glob(f'{prefix}_*.parquet'):
+        with contextlib.suppress(OSError):
+            if now - old_path.stat().st_mtime >= max_age:
+                old_path.unlink()
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    except OSError:
+        return
+    os.close(fd)
+    try:
+        frame.to_parquet(tmp_path)
+        os.replace(tmp_path, path)
+    except Exception:
+        with contextlib.suppress(OSError):
+            os.unlink(tmp_path)
+
+@st.cache_resource
+def get_yf_session():
     session = requests.Session()
     session.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    adapter = requests.adapters.HTTPAdapter(pool_connections=10, pool_maxsize=10)
+    session.mount('https://', adapter)
+    return session
+
+@st.cache_resource
+def get_market_misses():
+    return {}
+
+def download_market_data_batch(tickers, period_days):
+    paths = {ticker: cache_path('market', (ticker, period_days)) for ticker in tickers}
+    market_data = {ticker: read_cached_frame(paths[ticker], MARKET_CACHE_TTL) for ticker in tickers}
+    misses = get_market_misses()
+    now = time.time()
+    missing = [ticker for ticker in tickers
+               if market_data[ticker] is None and now - misses.get((ticker, period_days), 0) >= MARKET_MISS_TTL]
+    if not missing:
+        return market_data
     try:
-        data = yf.download(ticker, period=f'{period_days}d', progress=False, session=session)
-        return data if not data.empty else None
+        raw = yf.download(missing, period=f'{period_days}d', group_by='ticker', threads=True,
+                          auto_adjust=False, progress=False, session=get_yf_session())
     except Exception:
-        return None
+        raw = pd.DataFrame()
+    for ticker in missing:
+        if raw.empty:
+            frame = None
+        elif not isinstance(raw.columns, pd.MultiIndex):
+            frame = raw  # yfinance returns flat columns for a single ticker
+        elif ticker in raw.columns.get_level_values(0):
+            frame = raw[ticker]
+        else:
+            frame = None
+        data = frame[['Close']].dropna() if frame is not None else None
+        if data is None or data.empty:
+            misses[(ticker, period_days)] = now
+            continue
+        misses.pop((ticker, period_days), None)
+        write_cached_frame(paths[ticker], data, MARKET_CACHE_TTL)
+        market_data[ticker] = data
+    return market_data
 
-@st.cache_data(ttl=3600)
-def get_google_trends(keywords, period_days):
+@st.cache_data(ttl=TRENDS_FETCH_MEMO_TTL)
+def fetch_google_trends(keywords, period_days):
+    from pytrends.request import TrendReq
     pytrends = TrendReq(hl='en-US', tz=360, timeout=(10, 25), retries=3, backoff_factor=0.5)
-    all_trends_dfs = []
-    for keyword in keywords:
-        try:
-            pytrends.build_payload([keyword], cat=0, timeframe=f'today {period_days}-d', geo='', gprop='')
-            trend_df = pytrends.interest_over_time()
-            if not trend_df.empty:
-                if 'isPartial' in trend_df.columns:
-                    trend_df.drop(columns=['isPartial'], inplace=True)
-                all_trends_dfs.append(trend_df)
-            time.sleep(1)
-        except Exception:
-            continue
-    if not all_trends_dfs:
-        return None
     try:
-        final_df = pd.concat(all_trends_dfs, axis=1)
-        final_df = final_df.loc[:,~final_df.columns.duplicated()]
-        return final_df if len(final_df) > 1 else None
+        pytrends.build_payload(list(keywords)[:5], cat=0, timeframe=f'today {period_days}-d', geo='', gprop='')
+        trend_df = pytrends.interest_over_time()
     except Exception:
         return None
+    if trend_df.empty:
+        return None
+    trend_df = trend_df.drop(columns=['isPartial'], errors='ignore')
+    # Rescale each keyword to its own 0-100
+    trend_df = trend_df.div(trend_df.max().replace(0, np.nan)).mul(100)
+    return trend_df if len(trend_df) > 1 else None
 
-with st.spinner("Downloading market data..."):
-    equity_data = download_market_data(eq_ticker, lookback_days)
-    fx_data = download_market_data(fx_ticker, lookback_days)
-    local_equity_data = download_market_data(local_eq_ticker, lookback_days)
-    trends_data = get_google_trends(country_data['trends_keywords'], lookback_days)
-
-if equity_data is None or fx_data is None:
-    st.error("Essential Equity (ETF) or FX data could not be downloaded. Dashboard cannot continue.")
-    st.stop()
-
-# --- DATA PROCESSING ---
+def get_google_trends(keywords, period_days):
+    path = cache_path('trends', (keywords, period_days))
+    cached = read_cached_frame(path, TRENDS_CACHE_TTL)
+    if cached is not None:
+        return cached
+    trend_df = fetch_google_trends(keywords, period_days)
+    if trend_df is None:
+        return read_cached_frame(path)
+    write_cached_frame(path, trend_df, TRENDS_STALE_MAX_AGE)
+    return trend_df
 
-df = pd.DataFrame(index=equity_data.index)
-df['Equity_Price'] = equity_data['Close']
-df['FX_Price'] = fx_data['Close']
-if local_equity_data is not None and len(local_equity_data) > 5:
-    df['Local_Equity_Price'] = local_equity_data['Close']
+# --- CALCULATIONS ---
 
-df.ffill(inplace=True)
-df.bfill(inplace=True)
-df.dropna(subset=['Equity_Price', 'FX_Price'], inplace=True)
+def calculate_returns(prices):
+    returns = np.empty_like(prices)
+    returns[0] = np.nan
+    np.log(prices[1:] / prices[:-1], out=returns[1:])
+    return returns
 
-if 'Local_Equity_Price' not in df.columns:
-    df['Local_Equity_Price'] = df['Equity_Price'] # Fallback
+NUMBA_KWARGS = {'nopython': True, 'nogil': True}
 
-# --- CALCULATIONS ---
+@st.cache_resource
+def warm_up_rolling_engine():
+    rolling = pd.Series(np.ones(30)).rolling(window=10)
+    rolling.mean(engine='numba', engine_kwargs=NUMBA_KWARGS)
+    rolling.std(engine='numba', engine_kwargs=NUMBA_KWARGS)
 
-def calculate_returns(prices):
-    return prices.pct_change()
+warm_up_rolling_engine()
 
 def calculate_volatility(returns, window):
-    if len(returns.dropna()) < window:
-        return pd.Series(np.nan, index=returns.index)
-    return returns.rolling(window=window).std() * np.sqrt(252)
+    return returns.rolling(window=window, min_periods=window).std(engine='numba', engine_kwargs=NUMBA_KWARGS) * np.sqrt(252)
 
 def calculate_zscore(series, window=20):
-    if len(series.dropna()) < window:
-        return pd.Series(np.nan, index=series.index)
-    return (series - series.rolling(window=window).mean()) / series.rolling(window=window).std()
+    rolling = series.rolling(window=window, min_periods=window)
+    return (series - rolling.mean(engine='numba', engine_kwargs=NUMBA_KWARGS)) / rolling.std(engine='numba', engine_kwargs=NUMBA_KWARGS)
 
-df['Equity_Returns'] = calculate_returns(df['Equity_Price'])
-df['FX_Returns'] = calculate_returns(df['FX_Price'])
-df['Return_Spread'] = df['Equity_Returns'] - df['FX_Returns']
-df['Spread_ZScore'] = calculate_zscore(df['Return_Spread'])
-df['Equity_Volatility'] = calculate_volatility(df['Equity_Returns'], volatility_window)
-df['FX_Volatility'] = calculate_volatility(df['FX_Returns'], volatility_window)
+# --- DATA PROCESSING ---
 
-df_cleaned = df.dropna()
+@st.cache_data(ttl=PIPELINE_CACHE_TTL)
+def compute_pipeline(country, lookback_days, volatility_window):
+    country_data = countries[country]
+    tickers = (country_data['equity'], country_data['currency'], country_data['local_equity'])
+    market_data = download_market_data_batch(tickers, lookback_days)
+    equity_data, fx_data, local_equity_data = (market_data[ticker] for ticker in tickers)
+    if equity_data is None or fx_data is None:
+        return None
+
+    if local_equity_data is not None and len(local_equity_data) > 5:
+        local_equity_close = local_equity_data['Close']
+    else:
+        local_equity_close = equity_data['Close'] # Fallback
+
+    df = pd.DataFrame({
+        'Equity_Price': equity_data['Close'],
+        'FX_Price': fx_data['Close'],
+        'Local_Equity_Price': local_equity_close,
+    }, index=equity_data.index).ffill().bfill().dropna(subset=['Equity_Price', 'FX_Price'])
+
+    returns = calculate_returns(df[['Equity_Price', 'FX_Price']].to_numpy(dtype=np.float64))
+    df = df.assign(
+        Equity_Returns=returns[:, 0],
+        FX_Returns=returns[:, 1],
+        Return_Spread=returns[:, 0] - returns[:, 1],
+        Spread_ZScore=lambda d: calculate_zscore(d['Return_Spread']),
+        Equity_Volatility=lambda d: calculate_volatility(d['Equity_Returns'], volatility_window),
+        FX_Volatility=lambda d: calculate_volatility(d['FX_Returns'], volatility_window),
+    )
+    return df.dropna()
+
+with st.spinner("Downloading market data..."):
+    df_cleaned = compute_pipeline(selected_country, lookback_days, volatility_window)
+    trends_data = get_google_trends(tuple(country_data['trends_keywords']), lookback_days)
+
+if df_cleaned is None:
+    st.error("Essential Equity (ETF) or FX data could not be downloaded. Dashboard cannot continue.")
+    st.stop()
 
 # --- UI LAYOUT ---
 
 st.markdown(f'<h2 class="model-header">📈 Market Overview - {selected_country}</h2>', unsafe_allow_html=True)
 
+# Latest values
+cols = {name: i for i, name in enumerate(df_cleaned.columns)}
+values = df_cleaned.to_numpy()
+last = values[-1] if len(values) else None
+
 col1, col2 = st.columns([2, 1])
 
 with col1:
     if not df_cleaned.empty:
-        fig_market = make_subplots(specs=[[{"secondary_y": True}]])
-        fig_market.add_trace(go.Scatter(x=df_cleaned.index, y=df_cleaned['Equity_Price'], name='Equity ETF', line=dict(color='blue')), secondary_y=False)
-        fig_market.add_trace(go.Scatter(x=df_cleaned.index, y=df_cleaned['FX_Price'], name='FX Rate', line=dict(color='red')), secondary_y=True)
-        fig_market.update_layout(
-            height=500, title_text=f'Price Performance', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1)
+        idx = df_cleaned.index.values
+        fig_market = go.Figure(
+            data=[
+                go.Scattergl(x=idx, y=values[:, cols['Equity_Price']], name='Equity ETF', line=dict(color='blue'), yaxis='y'),
+                go.Scattergl(x=idx, y=values[:, cols['FX_Price']], name='FX Rate', line=dict(color='red'), yaxis='y2'),
+            ],
+            layout=go.Layout(
+                height=500, title_text='Price Performance', legend=dict(orientation="h", yanchor="bottom", y=1.02, xanchor="right", x=1),
+                yaxis=dict(title_text="Equity Price (USD)"),
+                yaxis2=dict(title_text="FX Rate (vs. USD)", overlaying='y', side='right'),
+            ),
         )
-        fig_market.update_yaxes(title_text="Equity Price (USD)", secondary_y=False)
-        fig_market.update_yaxes(title_text="FX Rate (vs. USD)", secondary_y=True)
         st.plotly_chart(fig_market, use_container_width=True)
     else:
         st.warning("Not enough data for price chart.")
@@ -214,10 +341,10 @@ with col1:
 with col2:
     st.markdown('<h3 class="model-header">📊 Key Metrics</h3>', unsafe_allow_html=True)
     if not df_cleaned.empty:
-        st.metric("Equity ETF", f"${df_cleaned['Equity_Price'].iloc[-1]:.2f}")
-        st.metric("FX Rate", f"{df_cleaned['FX_Price'].iloc[-1]:.4f}")
-        st.metric("Equity Volatility", f"{df_cleaned['Equity_Volatility'].iloc[-1]*100:.1f}%")
-        st.metric("FX Volatility", f"{df_cleaned['FX_Volatility'].iloc[-1]*100:.1f}%")
+        st.metric("Equity ETF", f"${last[cols['Equity_Price']]:.2f}")
+        st.metric("FX Rate", f"{last[cols['FX_Price']]:.4f}")
+        st.metric("Equity Volatility", f"{last[cols['Equity_Volatility']]*100:.1f}%")
+        st.metric("FX Volatility", f"{last[cols['FX_Volatility']]*100:.1f}%")
     else:
         st.info("No metrics to display.")
 
@@ -228,16 +355,16 @@ mcol1, mcol2, mcol3 = st.columns(3)
 with mcol1:
     st.markdown('<h3 class="model-header">🔄 FX/Equity Spread</h3>', unsafe_allow_html=True)
     if not df_cleaned.empty:
-        current_zscore = df_cleaned['Spread_ZScore'].iloc[-1]
+        current_zscore = last[cols['Spread_ZScore']]
         st.metric("Spread Z-Score", f"{current_zscore:.2f}")
         if abs(current_zscore) > 2:
-            signal_class, signal_text = ("signal-bearish", "Short equities, long FX") if current_zscore > 2 else ("signal-bullish", "Long equities, short FX")
+            signal = 'spread_bearish' if current_zscore > 2 else 'spread_bullish'
         else:
-            signal_class, signal_text = "signal-neutral", "No divergence"
+            signal = 'spread_neutral'
     else:
         st.metric("Spread Z-Score", "N/A")
-        signal_class, signal_text = "signal-neutral", "Not enough data"
-    st.markdown(f'<div class="signal-box {signal_class}">{signal_text}</div>', unsafe_allow_html=True)
+        signal = 'not_enough_data'
+    st.markdown(SIGNAL_HTML[signal], unsafe_allow_html=True)
 
 with mcol2:
     st.markdown('<h3 class="model-header">📊 Sentiment</h3>', unsafe_allow_html=True)
@@ -247,30 +374,30 @@ with mcol2:
         if not trends_data['Concern_ZScore'].dropna().empty:
             current_concern_zscore = trends_data['Concern_ZScore'].iloc[-1]
             st.metric("Public Concern Z-Score", f"{current_concern_zscore:.2f}")
-            signal_class, signal_text = ("signal-bearish", "High Public Concern") if current_concern_zscore > 1.5 else ("signal-neutral", "Normal Concern")
+            signal = 'concern_high' if current_concern_zscore > 1.5 else 'concern_normal'
         else:
             st.metric("Public Concern Z-Score", "N/A")
-            signal_class, signal_text = "signal-neutral", "Not enough data"
+            signal = 'not_enough_data'
     else:
         st.metric("Public Concern Z-Score", "N/A")
-        signal_class, signal_text = "signal-neutral", "Could not load data"
-    st.markdown(f'<div class="signal-box {signal_class}">{signal_text}</div>', unsafe_allow_html=True)
+        signal = 'load_failed'
+    st.markdown(SIGNAL_HTML[signal], unsafe_allow_html=True)
 
 with mcol3:
     st.markdown('<h3 class="model-header">⚡️ Performance</h3>', unsafe_allow_html=True)
     if len(df_cleaned) > 5:
-        five_day_return = (df_cleaned['Equity_Price'].iloc[-1] / df_cleaned['Equity_Price'].iloc[-6] - 1) * 100
+        five_day_return = (last[cols['Equity_Price']] / values[-6, cols['Equity_Price']] - 1) * 100
         st.metric("Equity Momentum (5d)", f"{five_day_return:+.2f}%")
         if five_day_return > 2:
-            signal_class, signal_text = "signal-bullish", "Positive Momentum"
+            signal = 'momentum_positive'
         elif five_day_return < -2:
-            signal_class, signal_text = "signal-bearish", "Negative Momentum"
+            signal = 'momentum_negative'
         else:
-            signal_class, signal_text = "signal-neutral", "Neutral"
+            signal = 'momentum_neutral'
     else:
         st.metric("Equity Momentum (5d)", "N/A")
-        signal_class, signal_text = "signal-neutral", "Not enough data"
-    st.markdown(f'<div class="signal-box {signal_class}">{signal_text}</div>', unsafe_allow_html=True)
+        signal = 'not_enough_data'
+    st.markdown(SIGNAL_HTML[signal], unsafe_allow_html=True)
 
 # Footer
 st.markdown("---")
@@ -1,8 +1,8 @@
 import yfinance as yf
 
 tickers = ['EWZ', 'EWW', 'ECH', 'ARGT']
+data = yf.download(tickers, period='1mo', group_by='ticker', threads=True, progress=False)
 for ticker in tickers:
     print(f"Testing ticker: {ticker}")
-    data = yf.download(ticker, period='1mo')
-    print(data.head())
+    print(data[ticker].head())
     print("---")
\ No newline at end of file